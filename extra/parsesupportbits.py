@@ -18,11 +18,19 @@
 #
 
 # Standard imports
+import re
 from argparse import ArgumentParser
 # Custom imports
 import pysap
 
 
+# Support bit line format, e.g. "<prefix> <name>(<bit>)"
+support_bit_re = re.compile(r"[^ ]* ([^(]*)\(([^)]*)\)")
+
+# Mask of each bit inside a byte
+bit_masks = tuple(1 << i for i in range(8))
+
+
 # Command line options parser
 def parse_options():
 
@@ -48,20 +56,25 @@ def main():
     print("[*] Parsing input file", options.input_file)
 
     # Read and parse the data
-    with open(options.input_file, 'r') as f:
-        input_data = f.readlines()
-
-    data = {}
-    for line in input_data:
-        support_bit = line.split(' ', 1)[1].split('(', 1)
-        name, bit = support_bit[0], int(support_bit[1].split(')', 1)[0])
-        data[bit] = name
+    data = [None] * 256
+    last_bit = 0
+    with open(options.input_file, 'r', 1024 * 1024) as f:
+        for line in f:
+            support_bit = support_bit_re.match(line)
+            if not support_bit:
+                continue
+            name, bit = support_bit.group(1), int(support_bit.group(2))
+            data[bit] = name
+            if bit > last_bit:
+                last_bit = bit
+    # Keep only bits up to the last one found in the input
+    del data[last_bit + 1:]
 
     # Fill missing bits
     unknown_no = unused_no = 1
-    for bit in range(0, max(data.keys()) + 1):
-        if bit in data:
-            name = data[bit].replace(' ', '_')
+    for bit, name in enumerate(data):
+        if name is not None:
+            name = name.replace(' ', '_')
             if name == "UNUSED":
                 name = "UNUSED_%d" % unused_no
                 unused_no += 1
@@ -74,50 +87,53 @@ def main():
 
         data[bit] = name, unknown
 
-    pysap = wireshark_define = wireshark_hf = wireshark_parse = wireshark_module = ''
+    pysap = []
+    wireshark_define = []
+    wireshark_hf = []
+    wireshark_parse = []
+    wireshark_module = []
     bitfields = []
     currentbyte = []
-    for bit in list(data.keys()):
-        name, unknown = data[bit]
+    for bit, (name, unknown) in enumerate(data):
         notice = " (Unknown support bit)" if unknown else ''
 
         if (bit % 8) == 0 and bit != 0:
             bitfields.extend(reversed(currentbyte))
             currentbyte = []
-            wireshark_define += '\n'
-            wireshark_parse += 'offset+=1;\n'
-            wireshark_module += '\n'
+            wireshark_define.append('\n')
+            wireshark_parse.append('offset+=1;\n')
+            wireshark_module.append('\n')
 
         currentbyte.append((name, bit, notice))
 
-        bitt = 1 << bit % 8
-        wireshark_define += '#define SAPDIAG_SUPPORT_BIT_%s\t0x%02x  /* %d%s */\n' % (name, bitt, bit, notice)
+        bitt = bit_masks[bit & 7]
+        wireshark_define.append('#define SAPDIAG_SUPPORT_BIT_%s\t0x%02x  /* %d%s */\n' % (name, bitt, bit, notice))
 
-        wireshark_hf += 'static int hf_SAPDIAG_SUPPORT_BIT_%s = -1;\n' % name
+        wireshark_hf.append('static int hf_SAPDIAG_SUPPORT_BIT_%s = -1;\n' % name)
 
-        wireshark_parse += 'proto_tree_add_item(tree, hf_SAPDIAG_SUPPORT_BIT_%s, tvb, offset, 1, ENC_BIG_ENDIAN);' \
-                           '  /* %d%s */\n' % (name, bit, notice)
+        wireshark_parse.append('proto_tree_add_item(tree, hf_SAPDIAG_SUPPORT_BIT_%s, tvb, offset, 1, ENC_BIG_ENDIAN);'
+                               '  /* %d%s */\n' % (name, bit, notice))
 
-        wireshark_module += '{ &hf_SAPDIAG_SUPPORT_BIT_%s,\n\t{ "Support Bit %s", ' \
-                            '"sapdiag.diag.supportbits.%s", FT_BOOLEAN, 8, NULL, ' \
-                            'SAPDIAG_SUPPORT_BIT_%s, "SAP Diag Support Bit %s",\n\tHFILL }},\n' % (name, name, name,
-                                                                                                   name, name)
+        wireshark_module.append('{ &hf_SAPDIAG_SUPPORT_BIT_%s,\n\t{ "Support Bit %s", '
+                                '"sapdiag.diag.supportbits.%s", FT_BOOLEAN, 8, NULL, '
+                                'SAPDIAG_SUPPORT_BIT_%s, "SAP Diag Support Bit %s",\n\tHFILL }},\n' % (name, name, name,
+                                                                                                       name, name))
     for bit, bitfield in enumerate(bitfields):
         if (bit % 8) == 0 and bit != 0:
-            pysap += '\n'
-        pysap += '        BitField("%s", 0, 1),  # %d%s\n' % bitfield
-    pysap += '\n        BitField("padding_bits", 0, %d), ]' % (256 - len(bitfields))
+            pysap.append('\n')
+        pysap.append('        BitField("%s", 0, 1),  # %d%s\n' % bitfield)
+    pysap.append('\n        BitField("padding_bits", 0, %d), ]' % (256 - len(bitfields)))
 
     print("[*] pysap SAPDiagItems definition:")
-    print(pysap)
+    print(''.join(pysap))
     print("[*] wireshark plugin define:")
-    print(wireshark_define)
+    print(''.join(wireshark_define))
     print("[*] wireshark plugin hf definitions:")
-    print(wireshark_hf)
+    print(''.join(wireshark_hf))
     print("[*] wireshark plugin parsing:")
-    print(wireshark_parse)
+    print(''.join(wireshark_parse))
     print("[*] wireshark plugin module:")
-    print(wireshark_module)
+    print(''.join(wireshark_module))
 
 
 if __name__ == "__main__":
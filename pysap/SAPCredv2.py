@@ -18,6 +18,7 @@
 
 # Standard imports
 import logging
+from hashlib import sha256
 from binascii import unhexlify
 # External imports
 from scapy.packet import Packet
@@ -40,7 +41,6 @@ from pysap.utils.fields import ASN1F_CHOICE_SAFE
 from pysap.utils.crypto import dpapi_decrypt_blob
 # External imports
 from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.hashes import Hash, SHA256
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 
 
@@ -51,6 +51,37 @@ log_cred = logging.getLogger("pysap.cred")
 cred_key_fmt = "240657rsga&/%srwthgrtawe45hhtrtrsr35467b2dx3456j67mv67f89656f75"
 """Fixed key embedded in CommonCryptoLib for encrypted credentials"""
 
+crypto_backend = default_backend()
+"""Cryptography backend used for decrypting credentials"""
+
+cred_simple_iv = "\x00" * 8
+"""Empty IV used when decrypting credentials with the simple approach"""
+
+_simple_key_cache = {}
+_simple_key_cache_size = 128
+
+
+def get_simple_key(username):
+    """Returns the 3DES algorithm instance used to decrypt credentials with
+    the simple approach for a given username. The key is constructed using the
+    fixed key format and the username, and cached as it's the same for all the
+    credentials of a given user.
+
+    :param username: Username to use when decrypting
+    :type username: string
+
+    :return: 3DES algorithm instance with the derived key
+    :rtype: algorithms.TripleDES
+    """
+    try:
+        return _simple_key_cache[username]
+    except KeyError:
+        if len(_simple_key_cache) >= _simple_key_cache_size:
+            _simple_key_cache.clear()
+        algorithm = algorithms.TripleDES((cred_key_fmt % username)[:24])
+        _simple_key_cache[username] = algorithm
+        return algorithm
+
 
 class SAPCredv2_Decryption_Error(Exception):
     pass
@@ -77,10 +108,11 @@ class SAPCredv2_Cred_Plain(ASN1_Packet):
 
         :raise Exception: if the provider is invalid or unsupported
         """
-        if self.option1 and self.option1 in self.providers:
-            return self.providers[self.option1](self, cred)
-        else:
+        option1 = getattr(self.option1, "val", self.option1)
+        provider = self.providers.get(option1) if option1 else None
+        if provider is None:
             raise Exception("Invalid or unsupported provider")
+        return provider(self, cred)
 
     @staticmethod
     def decrypt_MSCryptProtect(plain, cred):
@@ -98,15 +130,16 @@ class SAPCredv2_Cred_Plain(ASN1_Packet):
         :rtype: string
         """
         entropy = cred.pse_path
-        return dpapi_decrypt_blob(unhexlify(plain.blob.val), entropy)
+        return dpapi_decrypt_blob(unhexlify(plain.pin.val), entropy)
 
     PROVIDER_MSCryptProtect = "MSCryptProtect"
     """Provider for Windows hosts using DPAPI"""
 
     providers = {
-        PROVIDER_MSCryptProtect: decrypt_MSCryptProtect,
+        PROVIDER_MSCryptProtect: decrypt_MSCryptProtect.__func__,
     }
-    """Definition of implemented providers"""
+    """Definition of implemented providers, mapping the provider name to the
+    decryption function"""
 
 
 CIPHER_ALGORITHM_3DES = 0
@@ -180,19 +213,23 @@ class SAPCredv2_Cred(ASN1_Packet):
             return ord(self.cipher.val_readable[1])
         return 0
 
-    def decrypt(self, username):
+    def decrypt(self, username, derived_keys=None):
         """Decrypt a credential given a particular username. Tries to identify the credential
         format and choose the decryption method to use.
 
         :param username: Username to use when decrypting
         :type username: string
 
+        :param derived_keys: cache of keys already derived, to reuse across credentials
+            and usernames
+        :type derived_keys: dict
+
         :return: decrypted object
         :rtype: SAPCredv2_Cred_Plain
         """
 
         if self.cipher_format_version == 1:
-            return self.decrypt_with_header(username)
+            return self.decrypt_with_header(username, derived_keys)
         else:
             return self.decrypt_simple(username)
 
@@ -210,40 +247,50 @@ class SAPCredv2_Cred(ASN1_Packet):
 
         blob = self.cipher.val_readable
 
-        # Construct the key using the key format and the username
-        key = (cred_key_fmt % username)[:24]
-        # Set empty IV
-        iv = "\x00" * 8
+        # Obtain the key constructed using the key format and the username
+        algorithm = get_simple_key(username)
 
-        # Decrypt the cipher text with the derived key and IV
-        decryptor = Cipher(algorithms.TripleDES(key), modes.CBC(iv), backend=default_backend()).decryptor()
+        # Decrypt the cipher text with the derived key and an empty IV
+        decryptor = Cipher(algorithm, modes.CBC(cred_simple_iv), backend=crypto_backend).decryptor()
         plain = decryptor.update(blob) + decryptor.finalize()
 
         return SAPCredv2_Cred_Plain(plain)
 
     def xor(self, string, start):
-        """XOR a given string using a fixed key and a starting number."""
-        key = 0x15a4e35
-        x = start
-        y = ""
-        for c in string:
-            x *= key
-            x += 1
-            y += chr(ord(c) ^ (x & 0xff))
-        return y
-
-    def derive_key(self, key, blob, header, username):
+        """XOR a given string using a fixed key and a starting number. Only the lower byte
+        of the generated numbers is used, so the state is kept reduced to it instead of
+        letting it grow on each iteration. Text strings are converted using the ordinal of
+        each character.
+        """
+        key = 0x15a4e35 & 0xff
+        x = start & 0xff
+        y = bytearray(string) if isinstance(string, bytes) else bytearray(ord(c) for c in string)
+        for i in range(len(y)):
+            x = (x * key + 1) & 0xff
+            y[i] ^= x
+        return bytes(y)
+
+    def derive_key(self, key, blob, header, username, derived_keys=None):
         """Derive a key using SAP's algorithm. The key is derived using SHA256 and xor from an
-        initial key, a header, salt and username.
+        initial key, a header, salt and username. If a cache of derived keys is provided, the
+        key is looked up there first and stored after derived.
         """
-        digest = Hash(SHA256(), backend=default_backend())
-        digest.update(key)
-        digest.update(blob[0:4])
-        digest.update(header.salt)
-        digest.update(self.xor(username, ord(header.salt[0])))
-        digest.update("" * 0x20)
-        hashed = digest.finalize()
-        derived_key = self.xor(hashed, ord(header.salt[1]))
+        cache_key = (key, username, blob[0:4], header.salt)
+        derived_key = derived_keys.get(cache_key) if derived_keys is not None else None
+
+        if derived_key is None:
+            salt = bytearray(header.salt)
+
+            digest = sha256()
+            digest.update(key)
+            digest.update(blob[0:4])
+            digest.update(header.salt)
+            digest.update(self.xor(username, salt[0]))
+            hashed = digest.digest()
+            derived_key = self.xor(hashed, salt[1])
+
+            if derived_keys is not None:
+                derived_keys[cache_key] = derived_key
 
         # Validate and select proper algorithm
         if header.algorithm == CIPHER_ALGORITHM_3DES:
@@ -253,7 +300,7 @@ class SAPCredv2_Cred(ASN1_Packet):
         else:
             raise SAPCredv2_Decryption_Error("Algorithm not supported")
 
-    def decrypt_with_header(self, username):
+    def decrypt_with_header(self, username, derived_keys=None):
         """Decrypt a credential file using the header. It handles 3DES and AES256 algorithms.
         Tries to parse the decrypted object into a plain credential object type. If it fails,
         probably due to an invalid username use to decrypt it, raises an exception.
@@ -261,6 +308,9 @@ class SAPCredv2_Cred(ASN1_Packet):
         :param username: Username to use when decrypting
         :type username: string
 
+        :param derived_keys: cache of keys already derived
+        :type derived_keys: dict
+
         :return: decrypted object
         :rtype: SAPCredv2_Cred_Plain
 
@@ -275,10 +325,10 @@ class SAPCredv2_Cred(ASN1_Packet):
             raise SAPCredv2_Decryption_Error("Version not supported")
 
         # Derive the key according to SAP's algorithm
-        algorithm, key, iv, cipher_text = self.derive_key(cred_key_fmt, blob, header, username)
+        algorithm, key, iv, cipher_text = self.derive_key(cred_key_fmt, blob, header, username, derived_keys)
 
         # Decrypt the cipher text with the derived key and IV
-        decryptor = Cipher(algorithm(key), modes.CBC(iv), backend=default_backend()).decryptor()
+        decryptor = Cipher(algorithm(key), modes.CBC(iv), backend=crypto_backend).decryptor()
         plain = decryptor.update(cipher_text) + decryptor.finalize()
 
         # Perform a final xor over the decrypted content with a fixed key
@@ -322,17 +372,15 @@ class SAPCredv2_Cred_LPS(ASN1_Packet):
     def common_name(self):
         """This reassembles the issuer construction from Scapy's X.509 Certificate class.
         """
-        name_str = ""
+        name_parts = []
         attrsDict = self.get_subject()
         for attrType, attrSymbol in _attrName_mapping:
             if attrType in attrsDict:
-                name_str += "/" + attrSymbol + "="
-                name_str += attrsDict[attrType]
+                name_parts.extend(("/", attrSymbol, "=", attrsDict[attrType]))
         for attrType in sorted(attrsDict):
             if attrType not in _attrName_specials:
-                name_str += "/" + attrType + "="
-                name_str += attrsDict[attrType]
-        return name_str
+                name_parts.extend(("/", attrType, "=", attrsDict[attrType]))
+        return "".join(name_parts)
 
     @property
     def pse_file_path(self):
@@ -361,12 +409,15 @@ class SAPCredv2_Cred_LPS(ASN1_Packet):
         else:
             return CIPHER_ALGORITHM_3DES
 
-    def decrypt(self, username=None):
+    def decrypt(self, username=None, derived_keys=None):
         """Decrypt a credential file using LPS.
 
         :param username: Username to use when decrypting. Not used but kept to match signature
         :type username: string
 
+        :param derived_keys: Not used but kept to match signature
+        :type derived_keys: dict
+
         :return: decrypted object
         :rtype: SAPCredv2_Cred_Plain
         """
@@ -398,3 +449,17 @@ class SAPCredv2(ASN1_Packet):
     """SAP Credv2 Credential set definition"""
     ASN1_codec = ASN1_Codecs.BER
     ASN1_root = ASN1F_SEQUENCE_OF("creds", None, SAPCredv2Cred)
+
+    def decrypt_all(self, username):
+        """Decrypt all the credentials in the set given a particular username. Keys derived
+        while decrypting a credential are reused for other credentials in the set sharing
+        the same cipher header and salt.
+
+        :param username: Username to use when decrypting
+        :type username: string
+
+        :return: decrypted objects, in the same order as the credentials in the set
+        :rtype: list of SAPCredv2_Cred_Plain
+        """
+        derived_keys = {}
+        return [cred.cred.decrypt(username, derived_keys) for cred in self.creds]
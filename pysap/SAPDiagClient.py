@@ -17,7 +17,7 @@
 #
 
 # Standard imports
-from random import randint
+from random import getrandbits
 from socket import error as SocketError
 from binascii import unhexlify as unhex
 # Custom imports
@@ -112,11 +112,13 @@ class SAPDiagConnection(object):
         Using a random IP address as terminal name in unpatched systems will
         make the 'terminal' field of the security audit log unreliable.
         """
-        return '.'.join(str(randint(0, 255)) for _ in range(4))
+        n = getrandbits(32)
+        return "%d.%d.%d.%d" % (n >> 24, (n >> 16) & 0xff, (n >> 8) & 0xff, n & 0xff)
 
     def get_support_data_item(self, support_data):
         if isinstance(support_data, str):
-            support_data = SAPDiagSupportBits(unhex(support_data))
+            # Whitespaces are discarded as the string might come from trace dumps
+            support_data = SAPDiagSupportBits(unhex("".join(support_data.split())))
 
         if isinstance(support_data, SAPDiagSupportBits):
             support_data = SAPDiagItem(item_type="APPL",
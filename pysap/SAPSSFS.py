@@ -17,12 +17,13 @@
 #
 
 # Standard imports
+import hmac
+import struct
 import logging
+from hashlib import sha1
 # External imports
 from scapy.packet import Packet
 from scapy.fields import (ByteField, YesNoByteField, LenField, StrFixedLenField, StrField, PacketListField)
-from cryptography.exceptions import InvalidSignature
-from cryptography.hazmat.primitives.hmac import HMAC
 from cryptography.hazmat.primitives.hashes import Hash, SHA1
 from cryptography.hazmat.backends import default_backend
 # Custom imports
@@ -37,6 +38,9 @@ log_ssfs = logging.getLogger("pysap.ssfs")
 ssfs_hmac_key_unobscured = "\xe3\xa0\x61\x11\x85\x41\x68\x99\xf3\x0e\xda\x87\x7a\x80\xcc\x69"
 """Fixed key embedded in rsecssfx binaries for validating integrity of records"""
 
+_ssfs_hmac = hmac.new(ssfs_hmac_key_unobscured, digestmod=sha1)
+"""HMAC-SHA1 context already initialized with the fixed key, copied for validating each record"""
+
 
 class SAPSSFSLKY(Packet):
     """SAP SSFS LKY file format packet.
@@ -112,6 +116,18 @@ class SAPSSFSDecryptedPayload(PacketNoPadded):
         return blob_hash == self.hash
 
 
+ssfs_data_record_header = struct.Struct("!12sIB7s64sQ24s24sBBB9s20s")
+"""Layout of the record header and data header of a data record, used to dissect both at once"""
+
+ssfs_data_record_header_fields = ("preamble", "length", "type", "filler1", "key_name", "timestamp", "user",
+                                  "host", "is_deleted", "is_stored_as_plaintext", "is_binary_data", "filler2",
+                                  "hmac")
+"""Name of the fields in the record header and data header of a data record"""
+
+ssfs_data_record_length = struct.Struct("!I")
+"""Layout of the length field in the record header of a data record, found at offset 12"""
+
+
 class SAPSSFSDataRecord(PacketNoPadded):
     """SAP SSFS Data Record.
 
@@ -140,6 +156,43 @@ class SAPSSFSDataRecord(PacketNoPadded):
         StrFixedLenField("data", None, length_from=lambda pkt: pkt.length - 176),
     ]
 
+    def do_dissect(self, s):
+        """Dissects the record header and data header with a single struct call instead of
+        going through each field. Records too short to contain both headers, or with an
+        invalid length, are dissected field by field.
+        """
+        header_size = ssfs_data_record_header.size
+        if len(s) < header_size:
+            return super(SAPSSFSDataRecord, self).do_dissect(s)
+
+        header = ssfs_data_record_header.unpack_from(s)
+        length = header[1]
+        if length < header_size:
+            return super(SAPSSFSDataRecord, self).do_dissect(s)
+
+        self.fields.update(zip(ssfs_data_record_header_fields, header))
+        self.fields["data"] = s[header_size:length]
+        remain = s[length:]
+
+        self.raw_packet_cache_fields = {}
+        self.raw_packet_cache = s[:-len(remain)] if remain else s
+        self.explicit = 1
+        return remain
+
+    _data_file = None
+
+    def setfieldval(self, attr, val):
+        """Sets a field value. If the key name is set, the records index of the data
+        file the record was last indexed in is invalidated."""
+        super(SAPSSFSDataRecord, self).setfieldval(attr, val)
+        if attr == "key_name" and self._data_file is not None:
+            self._data_file.invalidate_index()
+
+    @property
+    def stripped_key_name(self):
+        """Returns the key name without the padding"""
+        return self.key_name.rstrip(" ")
+
     def get_plain_data(self, key=None):
         if self.is_stored_as_plaintext:
             return self.data
@@ -147,28 +200,46 @@ class SAPSSFSDataRecord(PacketNoPadded):
             raise KeyError("Key need to be provided to get the plain data")
         return self.decrypt_data(key)
 
+    _decrypted_data = None
+
     def decrypt_data(self, key):
+        """Decrypts the data with the given key. The decrypted data is cached until new
+        data is set or a different key is used, as the same values are usually looked
+        up repeatedly."""
+        data = self.data
+        cached = self._decrypted_data
+        if cached is not None and cached[0] is data and cached[1] == key.key:
+            return cached[2]
+
         log_ssfs.debug("Decrypting record {}".format(self.key_name))
-        decrypted_data = rsec_decrypt(self.data, key.key)
+        decrypted_data = rsec_decrypt(data, key.key)
         decrypted_payload = SAPSSFSDecryptedPayload(decrypted_data)
         log_ssfs.warn("Decrypted payload integrity is {}".format(decrypted_payload.valid))
+        self._decrypted_data = (data, key.key, decrypted_payload.data)
         return decrypted_payload.data
 
+    def get_data_header(self):
+        """Returns the data header without the HMAC field. It's taken from the dissected
+        record if it wasn't modified, otherwise only the data header fields are built.
+        """
+        if self.raw_packet_cache is not None:
+            return self.raw_packet_cache[24:156]
+        header = b""
+        for field in self.fields_desc[4:12]:
+            header = field.addfield(self, header, self.getfieldval(field.name))
+        return header
+
     @property
     def valid(self):
         """Returns whether the HMAC-SHA1 value is valid for the given payload"""
 
         # Calculate the HMAC-SHA1
-        h = HMAC(ssfs_hmac_key_unobscured, SHA1(), backend=default_backend())
-        h.update(str(self)[24:156])  # Entire Data header without the HMAC field
+        h = _ssfs_hmac.copy()
+        h.update(self.get_data_header())  # Entire Data header without the HMAC field
         h.update(self.data)
 
         # Validate the signature
-        try:
-            h.verify(self.hmac)
-            return True
-        except InvalidSignature:
-            return False
+        return hmac.compare_digest(h.digest(), self.hmac)
 
     @property
     def deleted(self):
@@ -176,6 +247,41 @@ class SAPSSFSDataRecord(PacketNoPadded):
         return self.is_deleted == 1
 
 
+class SSFSRecordListField(PacketListField):
+    """Custom field that contains the list of records of a data file. Each record is
+    delimited using the length in its record header and dissected with only its own
+    data, instead of passing the remaining of the data file along to every record.
+    Records too short to contain both headers are dissected as a regular packet list.
+    """
+
+    def iter_records(self, pkt, s):
+        """Generator to dissect the records one by one.
+
+        :param s: the raw data to dissect the records from
+        :type s: string
+
+        :return: the dissected records
+        :rtype: SAPSSFSDataRecord
+        """
+        header_size = ssfs_data_record_header.size
+        offset = 0
+        while len(s) - offset >= header_size:
+            length = ssfs_data_record_length.unpack_from(s, offset + 12)[0]
+            if length < header_size:
+                break
+            yield self.m2i(pkt, s[offset:offset + length])
+            offset += length
+
+        remain = s[offset:]
+        if remain:
+            for record in super(SSFSRecordListField, self).getfield(pkt, remain)[1]:
+                yield record
+
+    def getfield(self, pkt, s):
+        # Records are dissected until the end of the data, as in a regular packet list
+        return "", list(self.iter_records(pkt, s))
+
+
 class SAPSSFSData(Packet):
     """SAP SSFS Data file format packet.
 
@@ -183,9 +289,69 @@ class SAPSSFSData(Packet):
     name = "SAP SSFS Data File"
 
     fields_desc = [
-        PacketListField("records", None, SAPSSFSDataRecord),
+        SSFSRecordListField("records", None, SAPSSFSDataRecord),
     ]
 
+    def do_dissect(self, s):
+        """Dissects the records without keeping a copy of them to track changes, as it's
+        done by default for list fields. As the raw cache of the data file is not kept
+        either, building it always relies on the records, which keep their own raw cache.
+        """
+        if s:
+            s, self.fields["records"] = self.get_field("records").getfield(self, s)
+        self.explicit = 1
+        return s
+
+    @classmethod
+    def iter_records(cls, s):
+        """Generator to dissect the records of a data file one by one, without dissecting
+        the whole data file first. Useful for looking up a few records on large files.
+
+        :param s: the raw data file
+        :type s: string
+
+        :return: the records in the data file
+        :rtype: SAPSSFSDataRecord
+        """
+        for record in cls.fields_desc[0].iter_records(None, s):
+            yield record
+
+    _records_index = None
+
+    def setfieldval(self, attr, val):
+        """Sets a field value. If the records are set, the records index is invalidated."""
+        super(SAPSSFSData, self).setfieldval(attr, val)
+        if attr == "records":
+            self.invalidate_index()
+
+    def invalidate_index(self):
+        """Invalidates the index of the records by key name, so it's rebuilt on the next
+        lookup. Setting the records or the key name of an indexed record invalidates it,
+        but it needs to be called after modifying the list of records in place.
+        """
+        self._records_index = None
+
+    def get_records_index(self):
+        """Returns an index of the records by key name. The index is built on first
+        use and kept until it's invalidated.
+
+        :return: records by key name, in the order they're found in the data file
+        :rtype: dict of string, list of SAPSSFSDataRecord
+        """
+        index = self._records_index
+        if index is None:
+            index = {}
+            for record in self.records or []:
+                index.setdefault(record.stripped_key_name, []).append(record)
+                record._data_file = self
+            self._records_index = index
+        return index
+
+    @property
+    def valid(self):
+        """Returns whether the HMAC-SHA1 values are valid for all the records"""
+        return all(record.valid for record in self.records or [])
+
     def has_record(self, key_name):
         """Returns if the data file contains a record with a given key name.
 
@@ -195,10 +361,7 @@ class SAPSSFSData(Packet):
         :return: if the data file contains the record with key_name
         :rtype: bool
         """
-        for record in self.records:
-            if record.key_name.rstrip(" ") == key_name:
-                return True
-        return False
+        return key_name in self.get_records_index()
 
     def get_records(self, key_name):
         """Generator to retrieve records with the given key name.
@@ -209,9 +372,8 @@ class SAPSSFSData(Packet):
         :return: the record with key_name
         :rtype: SAPSSFSDataRecord
         """
-        for record in self.records:
-            if record.key_name.rstrip(" ") == key_name:
-                yield record
+        for record in self.get_records_index().get(key_name, []):
+            yield record
 
     def get_record(self, key_name):
         """Returns the first record with the given key name.
@@ -222,7 +384,8 @@ class SAPSSFSData(Packet):
         :return: the record with key_name
         :rtype: SAPSSFSDataRecord
         """
-        return next(self.get_records(key_name), None)
+        records = self.get_records_index().get(key_name)
+        return records[0] if records else None
 
     def get_value(self, key_name, key=None):
         """Returns the value with the given key name.
@@ -236,7 +399,5 @@ class SAPSSFSData(Packet):
         :return: the value with key_name
         :rtype: bytes
         """
-        try:
-            return self.get_record(key_name).get_plain_data(key)
-        except AttributeError:
-            return None
+        record = self.get_record(key_name)
+        return record.get_plain_data(key) if record is not None else None
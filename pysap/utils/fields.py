@@ -160,8 +160,7 @@ class StrFixedLenPaddedField(StrFixedLenField):
 
     def addfield(self, pkt, s, val):
         l = self.length_from(pkt)
-        val += self.padd * l
-        return StrFixedLenField.addfield(self, pkt, s, val)
+        return s + (self.i2m(pkt, val) + self.padd * l)[:l]
 
 
 class StrNullFixedLenPaddedField(StrFixedLenField):
@@ -20,7 +20,7 @@
 import sys
 import unittest
 # External imports
-from scapy.asn1.asn1 import ASN1_PRINTABLE_STRING, ASN1_OID
+from scapy.asn1.asn1 import ASN1_IA5_STRING, ASN1_PRINTABLE_STRING, ASN1_OID
 from scapy.layers.x509 import X509_RDN, X509_AttributeTypeAndValue
 # Custom imports
 from tests.utils import data_filename
@@ -97,6 +97,25 @@ class PySAPCredV2Test(unittest.TestCase):
         cred = SAPCredv2(s).creds[0].cred
         plain = cred.decrypt(self.decrypt_username)
         self.assertEqual(plain.option1, SAPCredv2_Cred_Plain.PROVIDER_MSCryptProtect)
+        self.assertIs(plain.providers.get(plain.option1.val),
+                      SAPCredv2_Cred_Plain.decrypt_MSCryptProtect)
+
+        plain.option1 = ASN1_IA5_STRING("UnknownProvider")
+        with self.assertRaises(Exception) as context:
+            plain.decrypt_provider(cred)
+        self.assertEqual(str(context.exception), "Invalid or unsupported provider")
+
+    def test_credv2_plain_decrypt_provider(self):
+        """Test provider lookup of a crafted plain credential"""
+
+        plain = SAPCredv2_Cred_Plain(pin=self.decrypt_pin, option1="UnknownProvider")
+        with self.assertRaises(Exception) as context:
+            plain.decrypt_provider(None)
+        self.assertEqual(str(context.exception), "Invalid or unsupported provider")
+
+        plain = SAPCredv2_Cred_Plain(pin=self.decrypt_pin, option1=SAPCredv2_Cred_Plain.PROVIDER_MSCryptProtect)
+        plain.providers = {SAPCredv2_Cred_Plain.PROVIDER_MSCryptProtect: lambda plain, cred: plain.pin}
+        self.assertEqual(plain.decrypt_provider(None), self.decrypt_pin)
 
     def test_credv2_lps_off_v1_3des(self):
         """Test parsing of a version 1 3DES encrypted credential with LPS off"""
@@ -114,6 +133,7 @@ class PySAPCredV2Test(unittest.TestCase):
 
         cred = SAPCredv2(s).creds[0].cred
         self.validate_credv2_plain(cred)
+        self.validate_credv2_plain(cred, decrypt_username=u"username")
 
     def test_credv2_lps_off_v1_aes256(self):
         """Test parsing of a version 1 AES256 encrypted credential with LPS off"""
@@ -132,6 +152,44 @@ class PySAPCredV2Test(unittest.TestCase):
 
         cred = SAPCredv2(s).creds[0].cred
         self.validate_credv2_plain(cred)
+        self.validate_credv2_plain(cred, decrypt_username=u"username")
+
+    def test_credv2_decrypt_all(self):
+        """Test decryption of all the credentials in a set"""
+
+        for filename in ["credv2_lps_off_v0_3des", "credv2_lps_off_v1_3des",
+                         "credv2_lps_off_v1_aes256", "credv2_lps_on_v2_int_aes256"]:
+            with open(data_filename(filename), "rb") as fd:
+                s = fd.read()
+
+            creds = SAPCredv2(s)
+            plains = creds.decrypt_all(self.decrypt_username)
+            self.assertEqual(len(plains), len(creds.creds))
+            for plain in plains:
+                self.assertEqual(plain.pin.val, self.decrypt_pin)
+
+    def test_credv2_decrypt_derived_keys(self):
+        """Test decryption of credentials reusing derived keys"""
+
+        with open(data_filename("credv2_lps_off_v1_3des"), "rb") as fd:
+            cred_3des = SAPCredv2(fd.read()).creds[0]
+        with open(data_filename("credv2_lps_off_v1_aes256"), "rb") as fd:
+            cred_aes256 = SAPCredv2(fd.read()).creds[0]
+
+        # Two credentials sharing the same salt and one with a different salt
+        creds = SAPCredv2(creds=[cred_3des, cred_3des.copy(), cred_aes256])
+        plains = creds.decrypt_all(self.decrypt_username)
+        self.assertEqual(len(plains), 3)
+        for plain in plains:
+            self.assertEqual(plain.pin.val, self.decrypt_pin)
+
+        # Keys derived for other usernames are not reused
+        derived_keys = {}
+        self.assertRaises(Exception, cred_3des.cred.decrypt, "wronguser", derived_keys)
+        for cred in creds.creds:
+            plain = cred.cred.decrypt(self.decrypt_username, derived_keys)
+            self.assertEqual(plain.pin.val, self.decrypt_pin)
+        self.assertEqual(len(derived_keys), 3)
 
     def test_credv2_lps_on_v2_int_aes256(self):
         """Test parsing of a version 2 AES256 encrypted credential with LPS on, INT type"""
@@ -27,7 +27,8 @@ from scapy.packet import Packet, Raw
 from tests.utils import read_data_file
 from pysap.SAPDiag import (SAPDiagItems, SAPDiagItem, SAPDiag, bind_diagitem,
                            diag_item_get_class)
-from pysap.SAPDiagItems import SAPDiagDyntAtomItem
+from pysap.SAPDiagItems import SAPDiagDyntAtomItem, support_data
+from pysap.SAPDiagClient import SAPDiagConnection
 
 
 class PySAPDiagTest(unittest.TestCase):
@@ -158,6 +159,28 @@ class PySAPDiagTest(unittest.TestCase):
         self.assertEqual(str(item.item_value), str(item_value))
         self.assertIs(diag_item_get_class(item, "APPL", 0x99, 0xff), SAPDiagItemTest)
 
+    def test_sapdiag_connection_support_data(self):
+        """Test support data given as hex strings to a Diag connection"""
+        support_data_hex = str(support_data.item_value).encode("hex")
+        support_data_spaced = "\n".join(" ".join(support_data_hex[i:i + 2] for i in range(j, j + 32, 2))
+                                        for j in range(0, len(support_data_hex), 32))
+
+        connection = SAPDiagConnection("localhost", 3200, support_data=support_data_hex)
+        connection_spaced = SAPDiagConnection("localhost", 3200, support_data=support_data_spaced)
+        self.assertEqual(str(connection.support_data), str(support_data))
+        self.assertEqual(str(connection_spaced.support_data), str(support_data))
+
+        # Each connection gets its own copy of the support data item
+        other_connection = SAPDiagConnection("localhost", 3200, support_data=support_data_hex)
+        self.assertIsNot(connection.support_data, other_connection.support_data)
+        self.assertIsNot(connection.support_data.item_value, other_connection.support_data.item_value)
+
+        connection.support_data.item_value.SAPGUI_IMODE ^= 1
+        self.assertNotEqual(str(connection.support_data), str(support_data))
+        self.assertEqual(str(other_connection.support_data), str(support_data))
+        new_connection = SAPDiagConnection("localhost", 3200, support_data=support_data_hex)
+        self.assertEqual(str(new_connection.support_data), str(support_data))
+
 
 def test_suite():
     loader = unittest.TestLoader()
@@ -21,7 +21,7 @@ import unittest
 # External imports
 # Custom imports
 from tests.utils import data_filename
-from pysap.SAPSSFS import (SAPSSFSKey, SAPSSFSData, SAPSSFSLock)
+from pysap.SAPSSFS import (SAPSSFSKey, SAPSSFSData, SAPSSFSDataRecord, SAPSSFSLock)
 
 
 class PySAPSSFSKeyTest(unittest.TestCase):
@@ -89,12 +89,76 @@ class PySAPSSFSDataTest(unittest.TestCase):
             record = data.get_record(key)
             self.assertTrue(record.is_stored_as_plaintext)
 
+    def test_ssfs_data_record_index(self):
+        """Test the index of records is updated when records are modified in a SSFS Data file."""
+
+        with open(data_filename("ssfs_hdb_dat"), "rb") as fd:
+            s = fd.read()
+
+        data = SAPSSFSData(s)
+        for key in self.PLAIN_VALUES:
+            self.assertTrue(data.has_record(key))
+
+        data.records = data.records[:1]
+        self.assertTrue(data.has_record("HDB/KEYNAME/DB_CON_ENV"))
+        self.assertFalse(data.has_record("HDB/KEYNAME/DB_USER"))
+
+        data.records.append(SAPSSFSData(s).get_record("HDB/KEYNAME/DB_USER"))
+        data.invalidate_index()
+        self.assertTrue(data.has_record("HDB/KEYNAME/DB_USER"))
+        self.assertEqual(len(list(data.get_records("HDB/KEYNAME/DB_USER"))), 1)
+
+    def test_ssfs_data_record_index_modified_records(self):
+        """Test the index of records is updated when records are renamed or replaced in a SSFS Data file."""
+
+        with open(data_filename("ssfs_hdb_dat"), "rb") as fd:
+            s = fd.read()
+
+        data = SAPSSFSData(s)
+        record = data.get_record("HDB/KEYNAME/DB_CON_ENV")
+        self.assertIs(record, data.records[0])
+
+        # Rename a record
+        record.key_name = "RENAMED"
+        self.assertTrue(data.has_record("RENAMED"))
+        self.assertIs(data.get_record("RENAMED"), record)
+        self.assertFalse(data.has_record("HDB/KEYNAME/DB_CON_ENV"))
+        self.assertIsNone(data.get_record("HDB/KEYNAME/DB_CON_ENV"))
+
+        # Replace a record in place
+        other_record = SAPSSFSData(s).get_record("HDB/KEYNAME/DB_USER")
+        data.records[0] = other_record
+        data.invalidate_index()
+        self.assertFalse(data.has_record("RENAMED"))
+        self.assertIsNone(data.get_record("RENAMED"))
+        records = list(data.get_records("HDB/KEYNAME/DB_USER"))
+        self.assertEqual(len(records), 2)
+        self.assertIs(records[0], other_record)
+        self.assertIs(records[1], data.records[2])
+        self.assertIs(data.get_record("HDB/KEYNAME/DB_USER"), other_record)
+
+    def test_ssfs_data_iter_records(self):
+        """Test dissecting the records of a SSFS Data file one by one."""
+
+        with open(data_filename("ssfs_hdb_dat"), "rb") as fd:
+            s = fd.read()
+        data = SAPSSFSData(s)
+
+        records = list(SAPSSFSData.iter_records(s))
+        self.assertEqual(len(records), len(data.records))
+        for record, data_record in zip(records, data.records):
+            self.assertIsInstance(record, SAPSSFSDataRecord)
+            self.assertEqual(str(record), str(data_record))
+
+        self.assertEqual(list(SAPSSFSData.iter_records("")), [])
+
     def test_ssfs_data_record_hmac(self):
         """Test validation of header and data with HMAC field in a SSFS Data file."""
 
         with open(data_filename("ssfs_hdb_dat"), "rb") as fd:
             s = fd.read()
         data = SAPSSFSData(s)
+        self.assertTrue(data.valid)
 
         for record in data.records:
             self.assertTrue(record.valid)
@@ -117,6 +181,7 @@ class PySAPSSFSDataTest(unittest.TestCase):
             orginal_hmac = record.hmac
             record.hmac = orginal_hmac[:-1] + "A"
             self.assertFalse(record.valid)
+            self.assertFalse(data.valid)
             record.hmac = orginal_hmac
             self.assertTrue(record.valid)
 
@@ -145,6 +210,13 @@ class PySAPSSFSDataDecryptTest(unittest.TestCase):
             self.assertFalse(record.is_stored_as_plaintext)
             self.assertTrue(record.valid)
 
+            # Decrypted data is cached until the data changes
+            decrypted = record.decrypt_data(key)
+            self.assertIs(record.decrypt_data(key), decrypted)
+            record.data = bytes(bytearray(record.data))
+            self.assertIsNot(record.decrypt_data(key), decrypted)
+            self.assertEqual(record.decrypt_data(key), value)
+
 
 def test_suite():
     loader = unittest.TestLoader()